@@ -1,8 +1,18 @@
 # Refactored and Improved Lutris Cover Art Downloader
 
-import requests
+import argparse
+import asyncio
+import email.utils
+import errno
+import functools
+import itertools
+import aiofiles
+import httpx
 import sqlite3
 import os
+import shutil
+import time
+from urllib.parse import quote
 import inquirer
 
 # Constants - Define configuration at the top for easy modification
@@ -10,11 +20,57 @@ API_KEY_FILE = './apikey.txt'
 LUTRIS_DB_PATH_TEMPLATE = '/home/{user}/.local/share/lutris/pga.db'
 BANNER_CACHE_PATH_TEMPLATE = '/home/{user}/.cache/lutris/banners/'
 COVERART_CACHE_PATH_TEMPLATE = '/home/{user}/.cache/lutris/coverart/'
+LOOKUP_CACHE_PATH_TEMPLATE = '/home/{user}/.cache/lutris-art-downloader/cache.sqlite'
 BANNER_DIMENSIONS = '460x215'
 VERTICAL_DIMENSIONS = '600x900'
 STEAMGRIDDB_API_BASE_URL = 'https://www.steamgriddb.com/api/v2'
-COVER_ART_EXTENSIONS = ['.png', '.jpeg', '.jpg'] # Added list of extensions to check
+COVER_ART_EXTENSIONS = ('.png', '.jpeg', '.jpg') # Added list of extensions to check
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.3
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_RETRY_AFTER_STATUSES = (429, 503) # Statuses whose Retry-After header is honoured, as urllib3's Retry does
+HTTP_MAX_CONNECTIONS = 8
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+HTTP_TOTAL_TIMEOUT = 30 # Upper bound for a whole API call or image download, retries included
+CONCURRENCY_LIMIT = 32 # Higher than HTTP_MAX_CONNECTIONS since HTTP/2 multiplexes requests over each connection
+STREAM_THRESHOLD = 4 * 1024 * 1024 # Images larger than this are written in chunks instead of in one go
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Download cover art for Lutris games from SteamGridDB.')
+    cover_type = parser.add_mutually_exclusive_group()
+    cover_type.add_argument('--banner', action='store_const', const='Banner', dest='cover_type',
+                            help='download Steam banners without asking')
+    cover_type.add_argument('--vertical', action='store_const', const='Vertical', dest='cover_type',
+                            help='download vertical covers without asking')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='ignore cached SteamGridDB game IDs and search for every game again')
+    parser.add_argument('--refresh', action='store_true',
+                        help='also check the covers previously downloaded by this script, downloading only the ones that changed')
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't list the games that already have a cover")
+    return parser.parse_args()
+
+@functools.lru_cache(maxsize=None)
+def pretty(slug):
+    """
+    Turns a game slug into a human-readable name (e.g., 'half-life-2' -> 'Half Life 2').
 
+    Args:
+        slug (str): The slug name of the game.
+
+    Returns:
+        str: The readable game name.
+    """
+    return slug.replace('-', ' ').title()
 
 def get_username():
     """
@@ -30,28 +86,34 @@ def get_username():
         print("Error: Could not get session username.")
         return None
 
-def get_cover_type():
+def get_cover_type(cover_type=None):
     """
-    Prompts the user to choose between Steam banners or vertical covers.
+    Prompts the user to choose between Steam banners or vertical covers, unless already chosen on the command line.
+
+    The prompt is shown at most once per run, as each inquirer prompt sets up the terminal again.
+
+    Args:
+        cover_type (str): 'Banner' or 'Vertical' to skip the prompt, or None to ask.
 
     Returns:
         tuple: A tuple containing:
             - str: Dimensions string (e.g., '460x215').
-            - str: Cover cache path.
-    """
-    questions = [
-        inquirer.List(
-            'cover_type',
-            message="Select the type of cover art to download:",
-            choices=['Banner', 'Vertical'],
-        ),
-    ]
-    answers = inquirer.prompt(questions)
-    if not answers:  # Handle user cancellation (e.g., Ctrl+C)
-        print("Operation cancelled by user.")
-        return None, None
+            - str: Cover cache path, always ending with a slash.
+    """
+    if not cover_type:
+        questions = [
+            inquirer.List(
+                'cover_type',
+                message="Select the type of cover art to download:",
+                choices=['Banner', 'Vertical'],
+            ),
+        ]
+        answers = inquirer.prompt(questions)
+        if not answers:  # Handle user cancellation (e.g., Ctrl+C)
+            print("Operation cancelled by user.")
+            return None, None
+        cover_type = answers['cover_type']
 
-    cover_type = answers['cover_type']
     print(f'Cover type set to {cover_type}\n')
 
     if cover_type == 'Banner':
@@ -60,6 +122,7 @@ def get_cover_type():
     else:  # 'Vertical'
         dimensions = VERTICAL_DIMENSIONS
         cache_path = COVERART_CACHE_PATH_TEMPLATE.format(user=username)
+    cache_path = cache_path.rstrip('/') + '/' # Normalized once so file paths can be built by concatenation
     return dimensions, cache_path
 
 def save_api_key(api_key):
@@ -124,21 +187,26 @@ def test_api_key(auth_header):
     Returns:
         bool: True if the API key is valid, False otherwise.
     """
-    test_url = f'{STEAMGRIDDB_API_BASE_URL}/grids/game/1?dimensions={VERTICAL_DIMENSIONS}' # Using vertical as default test dimension
+    test_url = f'{STEAMGRIDDB_API_BASE_URL}/grids/game/1'
+
+    async def request_test_grid():
+        async with create_async_client(auth_header) as client:
+            return await get_with_retries(client, test_url, params={'dimensions': VERTICAL_DIMENSIONS}) # Using vertical as default test dimension
+
     try:
-        response = requests.get(test_url, headers=auth_header)
+        response = asyncio.run(request_test_grid())
         response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
         if response.status_code == 200:
             print("API key is valid.")
             return True
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error testing API key: {e}")
     print("API key is invalid.")
     return False
 
 def connect_to_db(db_path):
     """
-    Connects to the Lutris SQLite database.
+    Connects to the Lutris SQLite database in read-only mode.
 
     Args:
         db_path (str): Path to the Lutris database file (pga.db).
@@ -147,7 +215,11 @@ def connect_to_db(db_path):
         sqlite3.Connection: Database connection object if successful, None otherwise.
     """
     try:
-        conn = sqlite3.connect(db_path)
+        # The script never writes to pga.db; not immutable though, as Lutris may be running and writing to it
+        conn = sqlite3.connect(f'file:{quote(db_path)}?mode=ro', uri=True)
+        conn.execute('PRAGMA query_only=1')
+        conn.execute('PRAGMA cache_size=-16384')
+        conn.execute('PRAGMA temp_store=MEMORY')
         return conn
     except sqlite3.Error as e:
         print(f"Error: Could not connect to Lutris database '{db_path}'.")
@@ -155,75 +227,439 @@ def connect_to_db(db_path):
         print("       Please ensure the path is correct or manually edit the script's path if necessary.")
         return None
 
-def search_game_id(game_name, auth_header):
+def get_existing_covers(cache_path):
+    """
+    Lists the games that already have a cover in the cache directory, in a single directory scan.
+
+    Args:
+        cache_path (str): The local path where cover art is saved.
+
+    Returns:
+        set: Slugs of the games with a cover file of any of the known extensions.
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    extensions = set(COVER_ART_EXTENSIONS)
+    try:
+        with os.scandir(cache_path) as entries:
+            return {
+                os.path.splitext(entry.name)[0]
+                for entry in entries
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions
+            }
+    except FileNotFoundError:
+        return set()
+
+def connect_to_cache(cache_db_path):
+    """
+    Opens the local cache of SteamGridDB game IDs and cover validators, creating it if needed.
+
+    Args:
+        cache_db_path (str): Path to the cache database file.
+
+    Returns:
+        sqlite3.Connection: Cache connection object if successful, None otherwise.
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_db_path), exist_ok=True)
+        conn = sqlite3.connect(cache_db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS sgdb_cache (slug TEXT PRIMARY KEY, sgdb_id INTEGER, ts INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS cover_cache (path TEXT PRIMARY KEY, url TEXT, etag TEXT, last_modified TEXT)')
+        return conn
+    except (OSError, sqlite3.Error) as e:
+        print(f"Warning: Could not open lookup cache '{cache_db_path}', continuing without it.")
+        print(f"         Details: {e}")
+        return None
+
+def write_to_cache(cache_conn, query, params):
+    """
+    Runs a write query on the lookup cache, warning instead of failing if the cache can't be written.
+
+    Args:
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None to do nothing.
+        query (str): The SQL query to run.
+        params (tuple): The query parameters.
+    """
+    if not cache_conn:
+        return
+    try:
+        cache_conn.execute(query, params)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not write to lookup cache: {e}")
+
+def commit_cache(cache_conn):
+    """
+    Commits the pending lookup cache writes, warning instead of failing if the cache can't be written.
+
+    Args:
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None to do nothing.
+    """
+    if not cache_conn:
+        return
+    try:
+        cache_conn.commit()
+    except sqlite3.Error as e:
+        print(f"Warning: Could not save lookup cache: {e}")
+
+def create_async_client(headers=None):
+    """
+    Creates an HTTP/2 client with bounded connections and timeouts.
+    Failed requests are retried by send_with_retries, not by the transport.
+
+    Args:
+        headers (dict): Headers sent with every request, or None.
+
+    Returns:
+        httpx.AsyncClient: The client, to be used as an async context manager.
+    """
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+    timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits)
+    return httpx.AsyncClient(transport=transport, headers=headers, timeout=timeout)
+
+async def with_total_timeout(coro, url):
+    """
+    Awaits a request coroutine, giving up once HTTP_TOTAL_TIMEOUT seconds are spent.
+
+    Args:
+        coro (coroutine): The request or download to await.
+        url (str): The URL being requested, for the error message.
+
+    Returns:
+        The result of the coroutine.
+
+    Raises:
+        httpx.TimeoutException: If the coroutine did not finish in time.
+    """
+    try:
+        return await asyncio.wait_for(coro, HTTP_TOTAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise httpx.TimeoutException(f"Request to {url} took longer than {HTTP_TOTAL_TIMEOUT} seconds") from None
+
+def get_retry_after(response):
+    """
+    Reads how long the server asked to wait before retrying.
+
+    Args:
+        response (httpx.Response): The response to a failed request.
+
+    Returns:
+        float: The delay in seconds, or None if the server didn't ask for one.
+    """
+    if response.status_code not in HTTP_RETRY_AFTER_STATUSES:
+        return None
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+async def send_with_retries(client, request, stream=False):
+    """
+    Sends a request, retrying transient failures with exponential backoff like urllib3's Retry does.
+    This is the only place requests are retried; callers bound the attempts with with_total_timeout.
+    A Retry-After header is honoured, unless waiting that long would exceed the HTTP_TOTAL_TIMEOUT budget,
+    in which case the failed response is returned right away.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2 client to send the request with.
+        request (httpx.Request): The request to send.
+        stream (bool): Whether to return before the body is read, so it can be streamed.
+
+    Returns:
+        httpx.Response: The last response received. A streamed response must be closed by the caller.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + HTTP_TOTAL_TIMEOUT
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        delay = HTTP_BACKOFF_FACTOR * 2 ** attempt
+        try:
+            response = await client.send(request, stream=stream)
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_MAX_RETRIES:
+                return response
+            retry_after = get_retry_after(response)
+            if retry_after is not None:
+                if retry_after > deadline - loop.time():
+                    return response
+                delay = retry_after
+            await response.aclose()
+        except httpx.TransportError:
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+        await asyncio.sleep(delay)
+
+async def get_with_retries(client, url, **kwargs):
+    """
+    Sends a GET request through send_with_retries, all attempts sharing the HTTP_TOTAL_TIMEOUT budget.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2 client carrying the authorization header.
+        url (str): The URL to request.
+        **kwargs: Extra arguments passed to client.build_request.
+
+    Returns:
+        httpx.Response: The last response received.
     """
-    Searches for a game ID on SteamGridDB using the game name.
+    return await with_total_timeout(send_with_retries(client, client.build_request('GET', url, **kwargs)), url)
+
+async def search_game_id(client, game_name, cache_conn=None, refresh_cache=False):
+    """
+    Searches for a game ID on SteamGridDB using the game name, going through the local cache first.
 
     Args:
+        client (httpx.AsyncClient): HTTP/2 client carrying the authorization header.
         game_name (str): The name of the game to search for.
-        auth_header (dict): Authorization header dictionary.
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None to always search.
+        refresh_cache (bool): Whether to skip the cached ID and search again.
 
     Returns:
         int: The game ID if found, None otherwise.
     """
-    search_url = f'{STEAMGRIDDB_API_BASE_URL}/search/autocomplete/{game_name}'
+    if cache_conn and not refresh_cache:
+        row = cache_conn.execute('SELECT sgdb_id FROM sgdb_cache WHERE slug=?', (game_name,)).fetchone()
+        if row:
+            print(f"Found game: {pretty(game_name)} (cached)")
+            return row[0]
+
+    search_url = f'{STEAMGRIDDB_API_BASE_URL}/search/autocomplete/{quote(game_name, safe="")}'
     try:
-        response = requests.get(search_url, headers=auth_header)
+        response = await get_with_retries(client, search_url)
         response.raise_for_status()
         data = response.json().get("data")
         if data and len(data) > 0:
-            print(f"Found game: {game_name.replace('-', ' ').title()}")
-            return data[0]["id"]
+            game_id = data[0]["id"]
+            print(f"Found game: {pretty(game_name)}")
+            write_to_cache(cache_conn, 'INSERT OR REPLACE INTO sgdb_cache (slug, sgdb_id, ts) VALUES (?, ?, ?)',
+                           (game_name, game_id, int(time.time())))
+            return game_id
         else:
             print(f"Warning: Could not find a cover for game '{game_name}' on SteamGridDB.")
             return None
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e: # ValueError covers malformed JSON bodies
         print(f"Error searching for game '{game_name}': {e}")
         return None
 
-def download_cover(game_name, game_id, dimensions, cache_path, auth_header):
+async def fetch_grid_url(client, game_id, dimensions):
     """
-    Downloads the cover art for a game from SteamGridDB.
+    Fetches the URL of the first grid with the given dimensions for a SteamGridDB game.
 
     Args:
-        game_name (str): The slug name of the game (from Lutris DB).
+        client (httpx.AsyncClient): HTTP/2 client carrying the authorization header.
         game_id (int): The SteamGridDB game ID.
         dimensions (str): The desired dimensions of the cover art (e.g., '460x215').
-        cache_path (str): The local path to save the cover art.
-        auth_header (dict): Authorization header dictionary.
+
+    Returns:
+        str: The grid URL if found, None otherwise.
+    """
+    grids_url = f'{STEAMGRIDDB_API_BASE_URL}/grids/game/{game_id}'
+    try:
+        response = await get_with_retries(client, grids_url, params={'dimensions': dimensions})
+        response.raise_for_status()
+        grids_data = response.json().get("data")
+        if grids_data and len(grids_data) > 0:
+            return grids_data[0]["url"]
+        return None
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e: # ValueError covers malformed JSON bodies
+        print(f"Error fetching grids for game ID {game_id}: {e}")
+        return None
+
+async def resolve_cover_url(client, game_slug, dimensions, sem, grid_tasks, cache_conn=None, refresh_cache=False):
+    """
+    Resolves the SteamGridDB game ID and grid URL for a game.
+
+    The semaphore is only held per request, so while this game waits for its grids,
+    searches for other games keep going instead of waiting for a whole phase to finish.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2 client carrying the authorization header.
+        game_slug (str): The slug name of the game (from Lutris DB).
+        dimensions (str): The desired dimensions of the cover art.
+        sem (asyncio.Semaphore): Semaphore bounding the number of requests in flight.
+        grid_tasks (dict): Grid lookups already started, by game ID, shared between games.
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None to always search.
+        refresh_cache (bool): Whether to skip the cached ID and search again.
+
+    Returns:
+        tuple: The game ID (or None) and the grid URL (or None).
     """
+    game_id = await run_bounded(sem, search_game_id(client, game_slug, cache_conn, refresh_cache))
     if not game_id:
-        return
+        return None, None
+    if game_id not in grid_tasks: # Games resolving to the same ID share a single grids request
+        grid_tasks[game_id] = asyncio.ensure_future(run_bounded(sem, fetch_grid_url(client, game_id, dimensions)))
+    return game_id, await grid_tasks[game_id]
 
-    print(f"Downloading cover for {game_name.replace('-', ' ').title()}...")
-    grids_url = f'{STEAMGRIDDB_API_BASE_URL}/grids/game/{game_id}?dimensions={dimensions}'
+def get_downloaded_covers(cache_conn, cache_path):
+    """
+    Lists the covers in the cache directory that were downloaded by this script and can be checked for updates.
+
+    Args:
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None.
+        cache_path (str): The local path where cover art is saved.
+
+    Returns:
+        set: Paths of the covers that have stored validators and are still on disk.
+    """
+    if not cache_conn:
+        return set()
+    rows = cache_conn.execute('SELECT path FROM cover_cache WHERE substr(path, 1, ?) = ?', (len(cache_path), cache_path))
+    return {path for (path,) in rows if os.path.isfile(path)}
+
+def get_cover_validators(cache_conn, filepath, url):
+    """
+    Builds the conditional request headers for a cover already saved on disk from the same URL.
+
+    Args:
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None.
+        filepath (str): The local path of the cover.
+        url (str): The URL the cover is about to be downloaded from.
+
+    Returns:
+        dict: If-None-Match/If-Modified-Since headers, empty if the cover has to be downloaded in full.
+    """
+    if not cache_conn or not os.path.isfile(filepath):
+        return {}
+    row = cache_conn.execute('SELECT etag, last_modified FROM cover_cache WHERE path=? AND url=?', (filepath, url)).fetchone()
+    if not row:
+        return {}
+    etag, last_modified = row
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+async def download_image(client, url, filepath, cache_conn=None):
+    """
+    Downloads an image and saves it to disk, streaming it in chunks only when it is unusually large.
+
+    If the image was already downloaded from the same URL, the request is made conditional
+    so an unchanged image is not transferred again.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2 client used for the download.
+        url (str): The URL of the image.
+        filepath (str): The local path to save the image to.
+        cache_conn (sqlite3.Connection): Lookup cache connection storing the validators, or None.
+
+    Returns:
+        bool: True if the image was written, False if it was unchanged.
+    """
+    request = client.build_request('GET', url, headers=get_cover_validators(cache_conn, filepath, url))
+    response = await send_with_retries(client, request, stream=True)
     try:
-        response = requests.get(grids_url, headers=auth_header)
+        if response.status_code == 304:
+            print(f"Cover unchanged: {filepath}")
+            return False
         response.raise_for_status()
-        grids_data = response.json().get("data")
+        content_length = int(response.headers.get('Content-Length', 0))
+        # Written aside then moved into place, so a cover hard-linked to other games is replaced rather than overwritten
+        partial_path = f'{filepath}.part'
+        try:
+            async with aiofiles.open(partial_path, 'wb') as f:
+                if content_length > STREAM_THRESHOLD:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        await f.write(chunk)
+                else:
+                    await f.write(await response.aread())
+        except BaseException: # Includes cancellation, which would otherwise leave the partial file behind too
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+    finally:
+        await response.aclose()
+    os.replace(partial_path, filepath)
+    print(f"Cover saved to: {filepath}")
+
+    write_to_cache(cache_conn, 'INSERT OR REPLACE INTO cover_cache (path, url, etag, last_modified) VALUES (?, ?, ?, ?)',
+                   (filepath, url, response.headers.get('ETag'), response.headers.get('Last-Modified')))
+    return True
+
+def link_or_copy(src, dst):
+    """
+    Hard-links a file to a new path, falling back to a copy when both paths are on different filesystems.
+    A different file already at the new path is replaced atomically, and kept if linking or copying fails.
 
-        if grids_data and len(grids_data) > 0:
-            cover_url = grids_data[0]["url"]
-            cover_response = requests.get(cover_url, stream=True) # Use stream=True for efficient downloading
-            cover_response.raise_for_status()
+    Args:
+        src (str): Path of the existing file.
+        dst (str): Path of the new file.
 
-            filepath = os.path.join(cache_path, f'{game_name}.jpg')
+    Returns:
+        bool: True if the new path was created, False if it already pointed to the same file.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return False
+    partial_path = f'{dst}.part'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    try:
+        try:
+            os.link(src, partial_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copyfile(src, partial_path)
+        os.replace(partial_path, dst)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return True
+
+async def download_cover_once(client, url, filepaths, cache_conn=None):
+    """
+    Downloads an image once and makes it available at every given path.
 
-            # **CREATE DIRECTORY IF IT DOESN'T EXIST:**
-            os.makedirs(cache_path, exist_ok=True)
+    Args:
+        client (httpx.AsyncClient): HTTP/2 client used for the download.
+        url (str): The URL of the image.
+        filepaths (list): The local paths to save the image to.
+        cache_conn (sqlite3.Connection): Lookup cache connection storing the validators, or None.
 
-            with open(filepath, 'wb') as f:
-                for chunk in cover_response.iter_content(chunk_size=8192): # Download in chunks
-                    f.write(chunk)
-            print(f"Cover saved to: {filepath}")
-        else:
-            print(f"Warning: Could not find a cover with dimensions '{dimensions}' for game '{game_name}' on SteamGridDB.")
+    Returns:
+        dict: Errors by path, for the paths the downloaded image could not be linked or copied to.
+    """
+    await with_total_timeout(download_image(client, url, filepaths[0], cache_conn), url)
+    errors = {}
+    for filepath in filepaths[1:]:
+        try:
+            if link_or_copy(filepaths[0], filepath):
+                print(f"Cover saved to: {filepath}")
+        except OSError as e:
+            errors[filepath] = e
+            continue
+        # Linked covers share the validators, so --refresh keeps them in step with the downloaded one
+        write_to_cache(cache_conn, 'INSERT OR REPLACE INTO cover_cache (path, url, etag, last_modified) '
+                                   'SELECT ?, url, etag, last_modified FROM cover_cache WHERE path=?',
+                       (filepath, filepaths[0]))
+    return errors
+
+async def run_bounded(sem, coro):
+    """
+    Awaits a coroutine while holding a slot of the given semaphore.
+
+    Args:
+        sem (asyncio.Semaphore): Semaphore bounding the number of coroutines running at once.
+        coro (coroutine): The coroutine to await.
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading cover for '{game_name}': {e}")
+    Returns:
+        The result of the coroutine.
+    """
+    async with sem:
+        return await coro
 
 
-def get_games_list_from_db(db_conn, cache_path, dimensions, auth_header):
+async def get_games_list_from_db(db_conn, cache_path, dimensions, auth_header, cache_conn=None, refresh_cache=False,
+                                 quiet=False, refresh=False):
     """
     Retrieves the list of games from the Lutris database and downloads covers if they are missing.
 
@@ -232,31 +668,69 @@ def get_games_list_from_db(db_conn, cache_path, dimensions, auth_header):
         cache_path (str): The local path to save the cover art.
         dimensions (str): The desired dimensions of the cover art.
         auth_header (dict): Authorization header dictionary.
+        cache_conn (sqlite3.Connection): Lookup cache connection, or None to always search.
+        refresh_cache (bool): Whether to skip cached game IDs and search again.
+        quiet (bool): Whether to skip listing the games that already have a cover.
+        refresh (bool): Whether to also check the covers previously downloaded by this script for updates.
     """
     cursor = db_conn.cursor()
     cursor.execute('SELECT slug FROM games')
-    games = cursor.fetchall()
 
-    if not games:
+    # Only the first row is read up front, to exit early without materializing the whole table
+    first_row = cursor.fetchone()
+    if first_row is None:
         print("No games found in Lutris database.")
         return
 
     print("Checking and downloading covers...")
-    for entry in games:
-        game_slug = entry[0]
-        cover_exists = False # Flag to track if a cover already exists
-
-        for ext in COVER_ART_EXTENSIONS: # Iterate through extensions
-            cover_filepath = os.path.join(cache_path, f'{game_slug}{ext}')
-            if os.path.isfile(cover_filepath):
-                cover_exists = True
-                break # If one extension exists, no need to check others
-
-        if not cover_exists:
-            game_id = search_game_id(game_slug, auth_header)
-            download_cover(game_slug, game_id, dimensions, cache_path, auth_header)
-        else:
-            print(f"Cover for '{game_slug.replace('-', ' ').title()}' already exists.")
+    existing = get_existing_covers(cache_path)
+    if refresh and not cache_conn:
+        print("Warning: --refresh needs the lookup cache, which could not be opened; no cover will be refreshed.")
+    refreshable = get_downloaded_covers(cache_conn, cache_path) if refresh else set()
+    missing = []
+    for (game_slug,) in itertools.chain([first_row], cursor): # Stream the remaining rows
+        if game_slug in existing and f'{cache_path}{game_slug}.jpg' not in refreshable:
+            if not quiet:
+                print(f"Cover for '{pretty(game_slug)}' already exists.")
+            continue
+        missing.append(game_slug)
+
+    sem = asyncio.Semaphore(CONCURRENCY_LIMIT)
+    # Images are served from a CDN that doesn't need the API key, so they get their own client without it.
+    async with create_async_client(auth_header) as api_client, create_async_client() as image_client:
+        grid_tasks = {}
+        resolved = await asyncio.gather(*(resolve_cover_url(api_client, game_slug, dimensions, sem, grid_tasks, cache_conn, refresh_cache)
+                                          for game_slug in missing), return_exceptions=True)
+        commit_cache(cache_conn)
+
+        # Several slugs can resolve to the same SteamGridDB game, whose cover only needs to be downloaded once
+        covers = {}
+        for game_slug, result in zip(missing, resolved):
+            if isinstance(result, Exception):
+                print(f"Error looking up game '{game_slug}': {result}")
+                continue
+            game_id, cover_url = result
+            if not game_id:
+                continue
+            if not cover_url:
+                print(f"Warning: Could not find a cover with dimensions '{dimensions}' for game '{game_slug}' on SteamGridDB.")
+                continue
+            print(f"Downloading cover for {pretty(game_slug)}...")
+            covers.setdefault(game_id, (cover_url, []))[1].append(game_slug)
+
+        downloads = [
+            download_cover_once(image_client, cover_url, [f'{cache_path}{game_slug}.jpg' for game_slug in game_slugs], cache_conn)
+            for cover_url, game_slugs in covers.values()
+        ]
+        results = await asyncio.gather(*(run_bounded(sem, coro) for coro in downloads), return_exceptions=True)
+        commit_cache(cache_conn)
+
+    for (_, game_slugs), result in zip(covers.values(), results):
+        for game_slug in game_slugs:
+            # A failed download affects every slug of the group, a failed link only its own slug
+            error = result if isinstance(result, Exception) else result.get(f'{cache_path}{game_slug}.jpg')
+            if error:
+                print(f"Error downloading cover for '{game_slug}': {error}")
 
     print('\nAll done! Restart Lutris for the changes to take effect.')
 
@@ -265,13 +739,15 @@ def main():
     """
     Main function to run the Lutris Cover Art Downloader script.
     """
+    args = parse_args()
+
     global username # Still using global here for initial username retrieval, can be passed around if preferred
     username = get_username()
     if not username:
         exit(1)
     print(f"Welcome {username} to Lutris Cover Art Downloader!\n")
 
-    dimensions, cover_cache_path = get_cover_type()
+    dimensions, cover_cache_path = get_cover_type(args.cover_type)
     if not dimensions or not cover_cache_path: # Exit if user cancelled or error in cover type selection
         exit(0)
 
@@ -287,9 +763,14 @@ def main():
         if not auth_header: # Exit if API key setup failed
             exit(1)
 
-    get_games_list_from_db(db_conn, cover_cache_path, dimensions, auth_header)
-
-    db_conn.close()
+    cache_conn = connect_to_cache(LOOKUP_CACHE_PATH_TEMPLATE.format(user=username))
+    try:
+        asyncio.run(get_games_list_from_db(db_conn, cover_cache_path, dimensions, auth_header,
+                                           cache_conn, args.refresh_cache, args.quiet, args.refresh))
+    finally:
+        if cache_conn:
+            cache_conn.close()
+        db_conn.close()
 
 
 if __name__ == '__main__':